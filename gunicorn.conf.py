@@ -0,0 +1,16 @@
+"""
+Gunicorn Configuration
+
+Runs the API as Uvicorn workers, one per CPU unless WEB_CONCURRENCY is set, so bcrypt and
+other CPU-bound work is not serialized on a single process's GIL. Every worker opens its own
+Mongo pool, so the server sees up to workers x MONGO_MAX_POOL_SIZE connections.
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "workers.UvloopWorker"
+keepalive = 30
+reload = os.getenv("RELOAD") == "1"
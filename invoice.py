@@ -0,0 +1,134 @@
+"""
+Invoice Template
+
+HTML invoice for /orders/{order_id}/invoice. The static chrome (head, styles, footer)
+is encoded to bytes once at import; only the order-specific middle goes through the
+precompiled Jinja2 template. Autoescaping is on, so buyer-supplied fields are rendered as text.
+"""
+
+from jinja2 import Environment
+from markupsafe import escape
+
+
+def rp(x) -> str:
+    """Format an amount as rupiah, e.g. Rp12.500"""
+    return f"Rp{int(x):,}".replace(",", ".")
+
+
+HEADER_PREFIX_BYTES = """\
+<!doctype html>
+<html>
+<head>
+  <meta charset='utf-8'/>
+  <meta name='viewport' content='width=device-width, initial-scale=1'/>
+  <title>""".encode()
+
+HEADER_SUFFIX_BYTES = """\
+</title>
+</head>
+<body style='font-family:Inter,system-ui,Segoe UI,Roboto,Arial,sans-serif;background:#f8fafc;padding:24px'>
+  <div style='max-width:840px;margin:0 auto;background:#fff;border:1px solid #e5e7eb;border-radius:12px;overflow:hidden'>
+""".encode()
+
+BODY_SRC = """\
+    <div style='display:flex;justify-content:space-between;align-items:center;padding:20px 24px;background:#ecfdf5;border-bottom:1px solid #e5e7eb'>
+      <div>
+        <div style='font-size:20px;font-weight:700;color:#065f46'>GreenFood</div>
+        <div style='color:#065f46'>Faktur Pembayaran</div>
+      </div>
+      <div style='text-align:right'>
+        <div style='font-size:12px;color:#047857'>Status</div>
+        <div style='font-weight:700;color:#065f46'>{{ status }}</div>
+      </div>
+    </div>
+    <div style='padding:20px 24px'>
+      <div style='display:flex;gap:24px;flex-wrap:wrap'>
+        <div style='flex:1;min-width:240px'>
+          <div style='font-size:12px;color:#6b7280'>Nomor Faktur</div>
+          <div style='font-weight:600'>{{ order_id }}</div>
+        </div>
+        <div style='flex:1;min-width:240px'>
+          <div style='font-size:12px;color:#6b7280'>Tanggal</div>
+          <div style='font-weight:600'>{{ created_str }}</div>
+        </div>
+      </div>
+
+      <div style='margin-top:16px;display:flex;gap:24px;flex-wrap:wrap'>
+        <div style='flex:1;min-width:240px'>
+          <div style='font-size:12px;color:#6b7280'>Pembeli</div>
+          <div style='font-weight:600'>{{ buyer_name }}</div>
+          <div style='font-size:12px;color:#6b7280'>{{ buyer_email }}</div>
+        </div>
+        <div style='flex:1;min-width:240px'>
+          <div style='font-size:12px;color:#6b7280'>Alamat</div>
+          <div style='font-weight:600'>{{ buyer_address }}</div>
+        </div>
+      </div>
+
+      <table style='width:100%;margin-top:24px;border-collapse:collapse'>
+        <thead>
+          <tr>
+            <th style='text-align:left;padding:8px;border-bottom:1px solid #e5e7eb;color:#6b7280;font-size:12px'>No</th>
+            <th style='text-align:left;padding:8px;border-bottom:1px solid #e5e7eb;color:#6b7280;font-size:12px'>Produk</th>
+            <th style='text-align:left;padding:8px;border-bottom:1px solid #e5e7eb;color:#6b7280;font-size:12px'>Qty</th>
+            <th style='text-align:right;padding:8px;border-bottom:1px solid #e5e7eb;color:#6b7280;font-size:12px'>Harga</th>
+            <th style='text-align:right;padding:8px;border-bottom:1px solid #e5e7eb;color:#6b7280;font-size:12px'>Subtotal</th>
+          </tr>
+        </thead>
+        <tbody>
+          {%- for item in items %}
+          <tr>
+            <td style='padding:8px;border-bottom:1px solid #eee'>#{{ loop.index }}</td>
+            <td style='padding:8px;border-bottom:1px solid #eee'>{{ item.title }}</td>
+            <td style='padding:8px;border-bottom:1px solid #eee'>{{ item.quantity|default(1)|int }}</td>
+            <td style='padding:8px;border-bottom:1px solid #eee;text-align:right'>{{ item.price|default(0)|int|rp }}</td>
+            <td style='padding:8px;border-bottom:1px solid #eee;text-align:right'>{{ (item.subtotal if item.subtotal is defined else (item.price|default(0)|int) * (item.quantity|default(1)|int))|rp }}</td>
+          </tr>
+          {%- endfor %}
+        </tbody>
+      </table>
+
+      <div style='margin-top:24px;display:flex;justify-content:flex-end'>
+        <div style='width:320px'>
+          <div style='display:flex;justify-content:space-between;padding:8px 0'>
+            <div style='color:#6b7280'>Subtotal</div>
+            <div style='font-weight:600'>{{ subtotal|rp }}</div>
+          </div>
+          <div style='display:flex;justify-content:space-between;padding:8px 0'>
+            <div style='color:#6b7280'>Diskon {{ coupon }}</div>
+            <div style='font-weight:600'>- {{ discount|rp }}</div>
+          </div>
+          <div style='display:flex;justify-content:space-between;padding:8px 0'>
+            <div style='color:#6b7280'>Ongkir</div>
+            <div style='font-weight:600'>{{ delivery|rp }}</div>
+          </div>
+          <div style='height:1px;background:#e5e7eb;margin:6px 0'></div>
+          <div style='display:flex;justify-content:space-between;padding:8px 0'>
+            <div style='font-weight:700'>Total</div>
+            <div style='font-weight:700;color:#065f46'>{{ total|rp }}</div>
+          </div>
+        </div>
+      </div>
+
+"""
+
+FOOTER_BYTES = """\
+      <div style='margin-top:16px;font-size:12px;color:#6b7280'>
+        Terima kasih telah berbelanja di GreenFood. Simpan halaman ini sebagai bukti pembayaran.
+      </div>
+    </div>
+  </div>
+</body>
+</html>
+""".encode()
+
+env = Environment(autoescape=True, enable_async=False)
+env.filters["rp"] = rp
+BODY_TPL = env.from_string(BODY_SRC)
+
+
+def render_invoice(**context) -> bytes:
+    """Render the full invoice page: prebuilt header, rendered order details, prebuilt footer."""
+    title = str(escape(f"Faktur #{context['order_id']} - GreenFood")).encode()
+    body = BODY_TPL.render(**context).encode()
+    return b"".join((HEADER_PREFIX_BYTES, title, HEADER_SUFFIX_BYTES, body, FOOTER_BYTES))
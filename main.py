@@ -1,49 +1,139 @@
 import os
-import uuid
+import re
+import logging
+import time
+import secrets
+import hashlib
+import threading
+
+import aiofiles
+import orjson
 from typing import Optional, List
 from datetime import datetime, timedelta, timezone
 
-from fastapi import FastAPI, HTTPException, Header, UploadFile, File, Form, Depends
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, HTTPException, Header, UploadFile, File, Form, Depends, Query, Body
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-from jose import jwt, JWTError
-from passlib.context import CryptContext
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+import jwt
+from jwt import InvalidTokenError
+import bcrypt
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne, ReturnDocument, IndexModel
+from pymongo.errors import DuplicateKeyError
+from cachetools import TTLCache
 
 from database import db, create_document, get_documents
+from invoice import render_invoice
+from middleware import AllowAllCORSMiddleware, MaxBodySizeMiddleware, SkipPathGZipMiddleware
 from schemas import Product, Category, Order, AuthUser, WalletTopup, WalletPayment
 
+logger = logging.getLogger(__name__)
+
 APP_TITLE = "GreenFood API"
 SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))
+QRIS_CACHE_TTL = 30
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+# Largest accepted request: one upload at the cap plus room for the other multipart fields
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES + 1024 * 1024
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """orjson response that encodes ObjectId/Decimal via str and Mongo's naive datetimes as UTC.
+
+    Returning it directly skips FastAPI's jsonable_encoder, so raw documents need no `_id` conversion.
+    """
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z)
 
-app = FastAPI(title=APP_TITLE)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app = FastAPI(title=APP_TITLE, default_response_class=MongoJSONResponse)
 
-# Ensure uploads directory exists and is served
+app.add_middleware(MaxBodySizeMiddleware, max_bytes=MAX_REQUEST_BYTES)
+app.add_middleware(AllowAllCORSMiddleware)
+app.add_middleware(SkipPathGZipMiddleware, skip_prefix="/uploads", minimum_size=1024, compresslevel=5)
+
+# Ensure uploads directory exists. In production nginx serves it directly (see nginx.conf)
+# and SERVE_UPLOADS=0 keeps image requests out of Python; the mount is the dev fallback.
 UPLOAD_DIR = os.path.join(os.getcwd(), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles with a year-long immutable Cache-Control; upload names are random and never rewritten."""
+
+    def file_response(self, *args, **kwargs) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+if os.getenv("SERVE_UPLOADS", "1") != "0":
+    app.mount("/uploads", ImmutableStaticFiles(directory=UPLOAD_DIR, check_dir=False), name="uploads")
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+ALLOWED_IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".webp"}
+
+
+# Indexes ensured at startup, one createIndexes command per collection; existing indexes are a no-op
+INDEXES = {
+    "authuser": [IndexModel("email", unique=True)],
+    "order": [IndexModel("buyer_id")],
+    # status equality + newest-first _id sort/cursor for /admin/topup-requests
+    "wallettopup": [IndexModel([("status", 1), ("_id", -1)])],
+    "setting": [IndexModel("key", unique=True)],
+    # Denylisted tokens drop out once they would have expired anyway
+    "revokedtoken": [IndexModel("expires_at", expireAfterSeconds=0)],
+    "product": [
+        IndexModel("category"),
+        # Text index backs `q` search on /products; lower-cased title index backs prefix mode
+        IndexModel([("title", "text"), ("description", "text")], weights={"title": 10, "description": 3}, name="product_text"),
+        IndexModel("title_lc"),
+    ],
+}
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    if db is None:
+        return
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except Exception as e:
+            logger.warning("Index creation failed on %s: %s", collection, e)
+    try:
+        # Products saved before title_lc existed would be invisible to prefix search
+        await db["product"].update_many(
+            {"title_lc": {"$exists": False}},
+            [{"$set": {"title_lc": {"$toLower": "$title"}}}],
+        )
+    except Exception as e:
+        logger.warning("title_lc backfill failed: %s", e)
 
 # Auth helpers
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
 
 
 def verify_password(password: str, hashed: str) -> bool:
-    return pwd_context.verify(password, hashed)
+    # Only bcrypt hashes were ever stored (passlib's bcrypt scheme before, bcrypt directly now).
+    # A truncated hash can panic inside bcrypt rather than raise, so check the length first
+    if not hashed or not hashed.startswith(BCRYPT_PREFIXES) or len(hashed) != 60:
+        return False
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+    except ValueError:
+        # Malformed stored hash, e.g. an out-of-range cost
+        return False
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -53,25 +143,185 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_user_by_email(email: str) -> Optional[dict]:
-    return db["authuser"].find_one({"email": email})
+USER_PROJECTION = {"email": 1, "name": 1, "role": 1, "balance": 1, "password_hash": 1, "is_active": 1}
+
+
+# Only identity goes into the token cache; balance is always read fresh by _id where it is shown
+IDENTITY_PROJECTION = {"email": 1, "name": 1, "role": 1}
+
+
+async def get_user_by_email(email: str, projection: dict = USER_PROJECTION) -> Optional[dict]:
+    return await db["authuser"].find_one({"email": email}, projection)
+
+
+# Decoded token -> (exp, identity) for repeat requests; keyed by a digest so raw tokens are not held
+_token_cache = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL)
+_token_cache_lock = threading.Lock()
 
 
-def get_current_user(authorization: Optional[str] = Header(default=None)) -> dict:
-    if not authorization or not authorization.lower().startswith("bearer "):
+def _bearer_token(authorization: Optional[str]) -> Optional[str]:
+    # Only the 7-char scheme prefix is lower-cased; no copy of the whole header, no split list
+    if not authorization or len(authorization) < 7 or authorization[:7].lower() != "bearer ":
+        return None
+    return authorization[7:].strip() or None
+
+
+def _token_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+async def get_current_user(authorization: Optional[str] = Header(default=None)) -> dict:
+    token = _bearer_token(authorization)
+    if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    token = authorization.split(" ")[1]
+    key = _token_key(token)
+    now = time.time()
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp", "sub"]})
         sub = payload.get("sub")
         if not sub:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = get_user_by_email(sub)
+        # Logged-out tokens are denylisted by digest until they expire
+        if await db["revokedtoken"].find_one({"_id": key}, {"_id": 1}):
+            raise HTTPException(status_code=401, detail="Token revoked")
+        user = await get_user_by_email(sub, IDENTITY_PROJECTION)
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
-        return user
-    except JWTError:
+    except InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    exp = payload.get("exp")
+    if exp and exp > now:
+        with _token_cache_lock:
+            _token_cache[key] = (exp, user)
+    return user
+
+
+async def get_optional_user(authorization: Optional[str] = Header(default=None)) -> Optional[dict]:
+    if not authorization:
+        return None
+    try:
+        return await get_current_user(authorization)
+    except HTTPException:
+        return None
+
+
+async def save_upload(upload: UploadFile, prefix: str = "", default_ext: str = ".jpg") -> str:
+    """Stream an uploaded image into UPLOAD_DIR in chunks and return its public URL."""
+    ext = (os.path.splitext(upload.filename or "")[1] or default_ext).lower()
+    if not (upload.content_type or "").startswith("image/"):
+        raise HTTPException(status_code=415, detail="File harus berupa gambar")
+    if ext not in ALLOWED_IMAGE_EXTS:
+        raise HTTPException(status_code=400, detail="Format gambar tidak didukung")
+    fname = f"{prefix}{secrets.token_hex(16)}{ext}"
+    dest_path = os.path.join(UPLOAD_DIR, fname)
+    if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File terlalu besar")
+    written = 0
+    try:
+        async with aiofiles.open(dest_path, "wb") as f:
+            # Reserve the full size up front so the filesystem does not grow the file chunk by chunk
+            if upload.size and hasattr(os, "posix_fallocate"):
+                try:
+                    await run_in_threadpool(os.posix_fallocate, f.fileno(), 0, upload.size)
+                except OSError:
+                    pass
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="File terlalu besar")
+                await f.write(chunk)
+    except BaseException:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return f"/uploads/{fname}"
+
+
+async def credit_topups(reqs: List[dict], claim: str) -> None:
+    """Credit claimed topups to their users, then mark them approved.
+
+    Every credit is guarded by the topup's _id in the user's `credited_topups`, so a request
+    released back to pending after a partial failure is never credited twice on retry.
+    """
+    ids = [req["_id"] for req in reqs]
+    now = datetime.now(timezone.utc)
+    try:
+        await db["authuser"].bulk_write(
+            [
+                UpdateOne(
+                    {"_id": ObjectId(req["user_id"]), "credited_topups": {"$ne": req["_id"]}},
+                    {
+                        "$inc": {"balance": int(req.get("amount", 0))},
+                        "$addToSet": {"credited_topups": req["_id"]},
+                        "$set": {"updated_at": now},
+                    },
+                )
+                for req in reqs
+            ],
+            ordered=True,
+        )
+    except Exception:
+        # Earlier writes may have landed: approve exactly those, release the rest for a retry
+        user_ids = list({ObjectId(req["user_id"]) for req in reqs})
+        credited = set()
+        async for u in db["authuser"].find({"_id": {"$in": user_ids}, "credited_topups": {"$in": ids}}, {"credited_topups": 1}):
+            credited.update(u["credited_topups"])
+        done = [i for i in ids if i in credited]
+        rest = [i for i in ids if i not in credited]
+        if done:
+            await db["wallettopup"].update_many(
+                {"_id": {"$in": done}, "claim": claim},
+                {"$set": {"status": "approved", "updated_at": now}, "$unset": {"claim": ""}},
+            )
+        if rest:
+            await db["wallettopup"].update_many(
+                {"_id": {"$in": rest}, "claim": claim},
+                {"$set": {"status": "pending"}, "$unset": {"claim": ""}},
+            )
+        raise
+    await db["wallettopup"].update_many(
+        {"_id": {"$in": ids}, "claim": claim},
+        {"$set": {"status": "approved", "updated_at": now}, "$unset": {"claim": ""}},
+    )
+
+
+async def approve_topups(req_ids: List[ObjectId]) -> int:
+    """Approve the pending topups among `req_ids`; returns how many were approved.
+
+    Requests are first claimed with a conditional pending -> approving flip, so two admins
+    approving at once cannot both pick up the same request.
+    """
+    claim = secrets.token_hex(8)
+    result = await db["wallettopup"].update_many(
+        {"_id": {"$in": req_ids}, "status": "pending"},
+        {"$set": {"status": "approving", "claim": claim, "updated_at": datetime.now(timezone.utc)}},
+    )
+    if not result.modified_count:
+        return 0
+    reqs = await db["wallettopup"].find(
+        {"_id": {"$in": req_ids}, "claim": claim}, {"user_id": 1, "amount": 1}
+    ).to_list(length=None)
+    await credit_topups(reqs, claim)
+    return len(reqs)
+
+
+def parse_object_id(raw: str) -> ObjectId:
+    try:
+        return ObjectId(raw)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid id")
+
+
+def order_oid(order_id: str) -> ObjectId:
+    return parse_object_id(order_id)
+
+
+def topup_oid(req_id: str) -> ObjectId:
+    return parse_object_id(req_id)
 
 
 def require_admin(user: dict):
@@ -79,33 +329,42 @@ def require_admin(user: dict):
         raise HTTPException(status_code=403, detail="Admin only")
 
 
+# Bodies that never change are serialized once at import
+ROOT_BODY = orjson.dumps({"message": f"{APP_TITLE} is running"})
+SCHEMA_BODY = orjson.dumps({"collections": ["authuser", "category", "product", "order", "wallettopup", "setting"]})
+
+
 @app.get("/")
-def read_root():
-    return {"message": f"{APP_TITLE} is running"}
+async def read_root():
+    return Response(ROOT_BODY, media_type="application/json")
 
 
 @app.get("/schema")
-def get_schema():
-    return {"collections": ["authuser", "category", "product", "order", "wallettopup", "setting"]}
+async def get_schema():
+    return Response(SCHEMA_BODY, media_type="application/json")
 
 
 # ---------- Auth Endpoints ----------
 @app.post("/auth/register")
-def register_user(name: str = Form(...), email: str = Form(...), password: str = Form(...)):
-    if db["authuser"].find_one({"email": email}):
+async def register_user(name: str = Form(...), email: str = Form(...), password: str = Form(...)):
+    if await db["authuser"].find_one({"email": email}):
         raise HTTPException(status_code=400, detail="Email already registered")
     # Always user role; admin will be set manually in DB
-    doc = AuthUser(email=email, name=name, password_hash=hash_password(password), role="user", balance=0, is_active=True).model_dump()
+    doc = AuthUser(email=email, name=name, password_hash=await run_in_threadpool(hash_password, password), role="user", balance=0, is_active=True).model_dump()
     doc["created_at"] = datetime.now(timezone.utc)
     doc["updated_at"] = datetime.now(timezone.utc)
-    res = db["authuser"].insert_one(doc)
+    try:
+        res = await db["authuser"].insert_one(doc)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration; the unique email index caught it
+        raise HTTPException(status_code=400, detail="Email already registered")
     return {"_id": str(res.inserted_id), "email": email, "role": "user"}
 
 
 @app.post("/auth/login")
-def login(email: str = Form(...), password: str = Form(...)):
-    user = get_user_by_email(email)
-    if not user or not verify_password(password, user.get("password_hash", "")):
+async def login(email: str = Form(...), password: str = Form(...)):
+    user = await get_user_by_email(email)
+    if not user or not await run_in_threadpool(verify_password, password, user.get("password_hash", "")):
         raise HTTPException(status_code=401, detail="Email atau password salah")
     token = create_access_token({"sub": user["email"], "role": user.get("role", "user")})
     return {
@@ -120,58 +379,84 @@ def login(email: str = Form(...), password: str = Form(...)):
     }
 
 
+@app.post("/auth/logout")
+async def logout(authorization: Optional[str] = Header(default=None), user: dict = Depends(get_current_user)):
+    token = _bearer_token(authorization)
+    key = _token_key(token)
+    # get_current_user already verified the signature; only exp is needed for the denylist TTL
+    exp = jwt.decode(token, options={"verify_signature": False})["exp"]
+    await db["revokedtoken"].update_one(
+        {"_id": key},
+        {"$setOnInsert": {"expires_at": datetime.fromtimestamp(exp, timezone.utc)}},
+        upsert=True,
+    )
+    # Other workers stop accepting the token once their cached entry ages out (TOKEN_CACHE_TTL)
+    with _token_cache_lock:
+        _token_cache.pop(key, None)
+    return {"status": "logged_out"}
+
+
 @app.get("/me")
-def me(user: dict = Depends(get_current_user)):
+async def me(user: dict = Depends(get_current_user)):
+    fresh = await db["authuser"].find_one({"_id": user["_id"]}, {"balance": 1}) or {}
     return {
         "email": user["email"],
         "name": user.get("name"),
         "role": user.get("role", "user"),
-        "balance": int(user.get("balance", 0)),
+        "balance": int(fresh.get("balance", 0)),
     }
 
 
 # ---------- Settings (QRIS) ----------
+# The QRIS image only changes when an admin uploads a new one; other workers pick it up within the TTL
+_qris_cache = {"v": None, "t": 0.0}
+
+
 @app.get("/settings/qris")
-def get_qris():
-    s = db["setting"].find_one({"key": "qris"})
-    if not s:
-        return {"image": None}
-    return {"image": s.get("image")}
+async def get_qris():
+    if time.monotonic() - _qris_cache["t"] < QRIS_CACHE_TTL:
+        return {"image": _qris_cache["v"]}
+    s = await db["setting"].find_one({"key": "qris"})
+    _qris_cache["v"] = s.get("image") if s else None
+    _qris_cache["t"] = time.monotonic()
+    return {"image": _qris_cache["v"]}
 
 
 @app.post("/settings/qris")
-def set_qris(image: UploadFile = File(...), user: dict = Depends(get_current_user)):
+async def set_qris(image: UploadFile = File(...), user: dict = Depends(get_current_user)):
     require_admin(user)
     try:
-        ext = os.path.splitext(image.filename or "")[1] or ".png"
-        fname = f"qris-{uuid.uuid4().hex}{ext}"
-        dest_path = os.path.join(UPLOAD_DIR, fname)
-        with open(dest_path, "wb") as f:
-            f.write(image.file.read())
-        image_url = f"/uploads/{fname}"
-        db["setting"].update_one({"key": "qris"}, {"$set": {"image": image_url, "updated_at": datetime.now(timezone.utc)}}, upsert=True)
+        image_url = await save_upload(image, prefix="qris-", default_ext=".png")
+        await db["setting"].update_one({"key": "qris"}, {"$set": {"image": image_url, "updated_at": datetime.now(timezone.utc)}}, upsert=True)
+        _qris_cache["t"] = 0.0
         return {"image": image_url}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Fields the list endpoints actually render; everything else stays in Mongo
+CATEGORY_LIST_PROJECTION = {"name": 1, "slug": 1, "icon": 1}
+PRODUCT_LIST_PROJECTION = {"title": 1, "price": 1, "category": 1, "in_stock": 1, "image": 1, "rating": 1}
+TOPUP_LIST_PROJECTION = {"user_id": 1, "email": 1, "amount": 1, "proof": 1, "status": 1, "created_at": 1}
+
+
 # ---------- Category ----------
 @app.get("/categories")
-def list_categories():
+async def list_categories():
     try:
-        cats = get_documents("category")
-        for c in cats:
-            c["_id"] = str(c["_id"])
-        return cats
+        cats = await get_documents("category", projection=CATEGORY_LIST_PROJECTION)
+        return MongoJSONResponse(cats)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/categories")
-def create_category(category: Category, user: dict = Depends(get_current_user)):
+async def create_category(category: Category, user: dict = Depends(get_current_user)):
     require_admin(user)
     try:
-        inserted_id = create_document("category", category)
+        inserted_id = await create_document("category", category.model_dump())
         return {"_id": inserted_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -179,23 +464,29 @@ def create_category(category: Category, user: dict = Depends(get_current_user)):
 
 # ---------- Products ----------
 @app.get("/products")
-def list_products(category: Optional[str] = None, q: Optional[str] = None):
+async def list_products(category: Optional[str] = None, q: Optional[str] = None, mode: Optional[str] = Query(None, pattern="^(text|prefix)$")):
     try:
         query = {}
+        projection = dict(PRODUCT_LIST_PROJECTION)
+        sort = None
         if category:
             query["category"] = category
         if q:
-            query["title"] = {"$regex": q, "$options": "i"}
-        prods = get_documents("product", query, limit=100)
-        for p in prods:
-            p["_id"] = str(p["_id"])
-        return prods
+            if mode == "prefix":
+                # Anchored regex without `i` on the lower-cased copy so the index can be range-scanned
+                query["title_lc"] = {"$regex": "^" + re.escape(q.lower())}
+            else:
+                query["$text"] = {"$search": q}
+                projection["score"] = {"$meta": "textScore"}
+                sort = [("score", {"$meta": "textScore"})]
+        prods = await get_documents("product", query, limit=100, projection=projection, sort=sort)
+        return MongoJSONResponse(prods)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/products")
-def create_product(
+async def create_product(
     user: dict = Depends(get_current_user),
     title: str = Form(...),
     price: float = Form(...),
@@ -208,48 +499,72 @@ def create_product(
     try:
         image_url = None
         if image is not None:
-            ext = os.path.splitext(image.filename or "")[1] or ".jpg"
-            fname = f"{uuid.uuid4().hex}{ext}"
-            dest_path = os.path.join(UPLOAD_DIR, fname)
-            with open(dest_path, "wb") as f:
-                f.write(image.file.read())
-            image_url = f"/uploads/{fname}"
+            image_url = await save_upload(image)
         payload = {
             "title": title,
+            "title_lc": title.lower(),
             "price": price,
             "description": description,
             "category": category,
             "in_stock": bool(in_stock) if in_stock is not None else True,
             "image": image_url,
         }
-        inserted_id = create_document("product", payload)
+        inserted_id = await create_document("product", payload)
         return {"_id": inserted_id, "image": image_url}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # ---------- Orders ----------
 @app.post("/orders")
-def create_order(order: Order, authorization: Optional[str] = Header(default=None)):
+async def create_order(order: Order, buyer: Optional[dict] = Depends(get_optional_user)):
     try:
-        buyer = None
-        if authorization:
-            try:
-                buyer = get_current_user(authorization)
-            except Exception:
-                buyer = None
+        doc = order.model_dump(exclude_none=True)
+        # Title, price and image are copied from the catalogue in one $in lookup so the
+        # stored order never depends on client-sent prices and the invoice needs no joins
+        product_ids = [parse_object_id(item["product_id"]) for item in doc["items"]]
+        products = {
+            p["_id"]: p
+            for p in await db["product"].find({"_id": {"$in": product_ids}}, {"title": 1, "price": 1, "image": 1}).to_list(length=None)
+        }
+        subtotal = 0
+        for pid, item in zip(product_ids, doc["items"]):
+            product = products.get(pid)
+            if not product:
+                raise HTTPException(status_code=400, detail=f"Produk tidak ditemukan: {item['product_id']}")
+            item["title"] = product.get("title")
+            item["price"] = product.get("price", 0)
+            if product.get("image"):
+                item["image"] = product["image"]
+            # Line totals are fixed at checkout so the invoice renders them without recomputing
+            item["subtotal"] = int(item["price"]) * int(item["quantity"])
+            subtotal += item["subtotal"]
+        if doc.get("discount", 0) > subtotal:
+            raise HTTPException(status_code=400, detail="Diskon melebihi subtotal")
+        doc["subtotal"] = subtotal
+        doc["total"] = subtotal - doc.get("discount", 0) + doc.get("delivery_fee", 0)
         # If paying with GreenPay balance, require sufficient balance and deduct immediately
         if order.payment_method == "greenpay" and buyer:
-            total = int(order.total)
-            current = int(buyer.get("balance", 0))
-            if current < total:
+            total = int(doc["total"])
+            # A non-positive debit would credit the wallet through the $inc below
+            if total <= 0:
+                raise HTTPException(status_code=400, detail="Total pesanan tidak valid")
+            # Check and debit in one atomic write so concurrent orders cannot overdraw
+            updated = await db["authuser"].find_one_and_update(
+                {"_id": buyer["_id"], "balance": {"$gte": total}},
+                {"$inc": {"balance": -total}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+                projection={"balance": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            if updated is None:
                 raise HTTPException(status_code=400, detail="Saldo GreenPay tidak cukup")
-            db["authuser"].update_one({"_id": buyer["_id"]}, {"$inc": {"balance": -total}, "$set": {"updated_at": datetime.now(timezone.utc)}})
-            order.status = "paid"
-        doc = order.model_dump()
+            doc["status"] = "paid"
         if buyer:
-            doc["buyer_id"] = str(buyer["_id"])
-        inserted_id = create_document("order", doc)
+            # Kept as ObjectId so the invoice $lookup can join on authuser._id
+            doc["buyer_id"] = buyer["_id"]
+        inserted_id = await create_document("order", doc)
         return {"_id": inserted_id, "status": doc.get("status", "received")}
     except HTTPException:
         raise
@@ -258,13 +573,12 @@ def create_order(order: Order, authorization: Optional[str] = Header(default=Non
 
 
 @app.get("/orders/{order_id}")
-def get_order(order_id: str):
+async def get_order(order_id: ObjectId = Depends(order_oid)):
     try:
-        row = db["order"].find_one({"_id": ObjectId(order_id)})
+        row = await db["order"].find_one({"_id": order_id})
         if not row:
             raise HTTPException(status_code=404, detail="Order not found")
-        row["_id"] = str(row["_id"])
-        return row
+        return MongoJSONResponse(row)
     except HTTPException:
         raise
     except Exception as e:
@@ -272,126 +586,48 @@ def get_order(order_id: str):
 
 
 @app.get("/orders/{order_id}/invoice", response_class=HTMLResponse)
-def get_order_invoice(order_id: str):
+async def get_order_invoice(order_id: ObjectId = Depends(order_oid)):
     try:
-        order = db["order"].find_one({"_id": ObjectId(order_id)})
-        if not order:
+        # Order and its registered buyer in a single round-trip
+        rows = await db["order"].aggregate([
+            {"$match": {"_id": order_id}},
+            {"$lookup": {"from": "authuser", "localField": "buyer_id", "foreignField": "_id", "as": "buyer"}},
+            {"$unwind": {"path": "$buyer", "preserveNullAndEmptyArrays": True}},
+            {"$limit": 1},
+            # Only what the invoice shows; password_hash and balance never leave the server
+            {"$project": {
+                "buyer.name": 1, "buyer.email": 1,
+                "buyer_name": 1, "buyer_email": 1, "buyer_address": 1, "created_at": 1, "status": 1,
+                "coupon_code": 1, "items": 1, "subtotal": 1, "discount": 1, "delivery_fee": 1, "total": 1,
+            }},
+        ]).to_list(length=1)
+        if not rows:
             raise HTTPException(status_code=404, detail="Order not found")
+        order = rows[0]
+        buyer = order.get("buyer") or {}
         created_at = order.get("created_at")
         created_str = created_at.strftime("%d %b %Y %H:%M") if created_at else ""
-        buyer_name = order.get("buyer_name")
-        buyer_email = order.get("buyer_email")
+        buyer_name = buyer.get("name") or order.get("buyer_name")
+        buyer_email = buyer.get("email") or order.get("buyer_email")
         buyer_address = order.get("buyer_address")
         status = order.get("status", "pending").upper()
         coupon = order.get("coupon_code") or "-"
-        subtotal = int(round(order.get("subtotal", 0)))
-        discount = int(round(order.get("discount", 0)))
-        delivery = int(round(order.get("delivery_fee", 0)))
-        total = int(round(order.get("total", 0)))
-        def rp(x: int) -> str:
-            return f"Rp{int(x):,}".replace(",", ".")
-        rows_html = "".join([
-            f"""
-            <tr>
-              <td style='padding:8px;border-bottom:1px solid #eee'>#{i+1}</td>
-              <td style='padding:8px;border-bottom:1px solid #eee'>{item.get('title')}</td>
-              <td style='padding:8px;border-bottom:1px solid #eee'>{int(item.get('quantity',1))}</td>
-              <td style='padding:8px;border-bottom:1px solid #eee;text-align:right'>{rp(int(item.get('price',0)))}</td>
-              <td style='padding:8px;border-bottom:1px solid #eee;text-align:right'>{rp(int(item.get('price',0))*int(item.get('quantity',1)))}</td>
-            </tr>
-            """
-            for i, item in enumerate(order.get("items", []))
-        ])
-        html = f"""
-        <!doctype html>
-        <html>
-        <head>
-          <meta charset='utf-8'/>
-          <meta name='viewport' content='width=device-width, initial-scale=1'/>
-          <title>Faktur #{order_id} - GreenFood</title>
-        </head>
-        <body style='font-family:Inter,system-ui,Segoe UI,Roboto,Arial,sans-serif;background:#f8fafc;padding:24px'>
-          <div style='max-width:840px;margin:0 auto;background:#fff;border:1px solid #e5e7eb;border-radius:12px;overflow:hidden'>
-            <div style='display:flex;justify-content:space-between;align-items:center;padding:20px 24px;background:#ecfdf5;border-bottom:1px solid #e5e7eb'>
-              <div>
-                <div style='font-size:20px;font-weight:700;color:#065f46'>GreenFood</div>
-                <div style='color:#065f46'>Faktur Pembayaran</div>
-              </div>
-              <div style='text-align:right'>
-                <div style='font-size:12px;color:#047857'>Status</div>
-                <div style='font-weight:700;color:#065f46'>{status}</div>
-              </div>
-            </div>
-            <div style='padding:20px 24px'>
-              <div style='display:flex;gap:24px;flex-wrap:wrap'>
-                <div style='flex:1;min-width:240px'>
-                  <div style='font-size:12px;color:#6b7280'>Nomor Faktur</div>
-                  <div style='font-weight:600'>{order_id}</div>
-                </div>
-                <div style='flex:1;min-width:240px'>
-                  <div style='font-size:12px;color:#6b7280'>Tanggal</div>
-                  <div style='font-weight:600'>{created_str}</div>
-                </div>
-              </div>
-
-              <div style='margin-top:16px;display:flex;gap:24px;flex-wrap:wrap'>
-                <div style='flex:1;min-width:240px'>
-                  <div style='font-size:12px;color:#6b7280'>Pembeli</div>
-                  <div style='font-weight:600'>{buyer_name}</div>
-                  <div style='font-size:12px;color:#6b7280'>{buyer_email}</div>
-                </div>
-                <div style='flex:1;min-width:240px'>
-                  <div style='font-size:12px;color:#6b7280'>Alamat</div>
-                  <div style='font-weight:600'>{buyer_address}</div>
-                </div>
-              </div>
-
-              <table style='width:100%;margin-top:24px;border-collapse:collapse'>
-                <thead>
-                  <tr>
-                    <th style='text-align:left;padding:8px;border-bottom:1px solid #e5e7eb;color:#6b7280;font-size:12px'>No</th>
-                    <th style='text-align:left;padding:8px;border-bottom:1px solid #e5e7eb;color:#6b7280;font-size:12px'>Produk</th>
-                    <th style='text-align:left;padding:8px;border-bottom:1px solid #e5e7eb;color:#6b7280;font-size:12px'>Qty</th>
-                    <th style='text-align:right;padding:8px;border-bottom:1px solid #e5e7eb;color:#6b7280;font-size:12px'>Harga</th>
-                    <th style='text-align:right;padding:8px;border-bottom:1px solid #e5e7eb;color:#6b7280;font-size:12px'>Subtotal</th>
-                  </tr>
-                </thead>
-                <tbody>
-                  {rows_html}
-                </tbody>
-              </table>
-
-              <div style='margin-top:24px;display:flex;justify-content:flex-end'>
-                <div style='width:320px'>
-                  <div style='display:flex;justify-content:space-between;padding:8px 0'>
-                    <div style='color:#6b7280'>Subtotal</div>
-                    <div style='font-weight:600'>{rp(subtotal)}</div>
-                  </div>
-                  <div style='display:flex;justify-content:space-between;padding:8px 0'>
-                    <div style='color:#6b7280'>Diskon {coupon if coupon else ''}</div>
-                    <div style='font-weight:600'>- {rp(discount)}</div>
-                  </div>
-                  <div style='display:flex;justify-content:space-between;padding:8px 0'>
-                    <div style='color:#6b7280'>Ongkir</div>
-                    <div style='font-weight:600'>{rp(delivery)}</div>
-                  </div>
-                  <div style='height:1px;background:#e5e7eb;margin:6px 0'></div>
-                  <div style='display:flex;justify-content:space-between;padding:8px 0'>
-                    <div style='font-weight:700'>Total</div>
-                    <div style='font-weight:700;color:#065f46'>{rp(total)}</div>
-                  </div>
-                </div>
-              </div>
-
-              <div style='margin-top:16px;font-size:12px;color:#6b7280'>
-                Terima kasih telah berbelanja di GreenFood. Simpan halaman ini sebagai bukti pembayaran.
-              </div>
-            </div>
-          </div>
-        </body>
-        </html>
-        """
-        return HTMLResponse(content=html)
+        context = {
+            "order_id": str(order_id),
+            "status": status,
+            "created_str": created_str,
+            "buyer_name": buyer_name,
+            "buyer_email": buyer_email,
+            "buyer_address": buyer_address,
+            "coupon": coupon,
+            "items": order.get("items", []),
+            "subtotal": int(round(order.get("subtotal", 0))),
+            "discount": int(round(order.get("discount", 0))),
+            "delivery": int(round(order.get("delivery_fee", 0))),
+            "total": int(round(order.get("total", 0))),
+        }
+        # Rendered in full here so template errors still surface as a 500
+        return HTMLResponse(render_invoice(**context))
     except HTTPException:
         raise
     except Exception as e:
@@ -400,17 +636,12 @@ def get_order_invoice(order_id: str):
 
 # ---------- Wallet (GreenPay) Topup with QRIS proof ----------
 @app.post("/wallet/topup-request")
-def wallet_topup_request(amount: int = Form(...), proof: UploadFile = File(...), user: dict = Depends(get_current_user)):
+async def wallet_topup_request(amount: int = Form(...), proof: UploadFile = File(...), user: dict = Depends(get_current_user)):
     try:
         amount = int(amount)
         if amount <= 0:
             raise HTTPException(status_code=400, detail="Jumlah top up tidak valid")
-        ext = os.path.splitext(proof.filename or "")[1] or ".jpg"
-        fname = f"topup-{uuid.uuid4().hex}{ext}"
-        dest_path = os.path.join(UPLOAD_DIR, fname)
-        with open(dest_path, "wb") as f:
-            f.write(proof.file.read())
-        proof_url = f"/uploads/{fname}"
+        proof_url = await save_upload(proof, prefix="topup-")
         doc = {
             "user_id": str(user["_id"]),
             "email": user.get("email"),
@@ -420,74 +651,106 @@ def wallet_topup_request(amount: int = Form(...), proof: UploadFile = File(...),
             "created_at": datetime.now(timezone.utc),
             "updated_at": datetime.now(timezone.utc),
         }
-        res_id = db["wallettopup"].insert_one(doc).inserted_id
+        res_id = (await db["wallettopup"].insert_one(doc)).inserted_id
         return {"_id": str(res_id), "status": "pending"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/admin/topup-requests")
-def list_topup_requests(status: Optional[str] = None, user: dict = Depends(get_current_user)):
+async def list_topup_requests(
+    status: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    user: dict = Depends(get_current_user),
+):
     require_admin(user)
     q = {}
     if status:
         q["status"] = status
-    rows = list(db["wallettopup"].find(q).sort("created_at", -1))
-    for r in rows:
-        r["_id"] = str(r["_id"])
-    return rows
+    # Keyset pagination: pass the last `_id` of the previous page as `cursor`
+    if cursor:
+        try:
+            q["_id"] = {"$lt": ObjectId(cursor)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    rows = await db["wallettopup"].find(q, TOPUP_LIST_PROJECTION).sort("_id", -1).limit(limit).to_list(length=limit)
+    return MongoJSONResponse(rows)
 
 
 @app.post("/admin/topup-requests/{req_id}/approve")
-def approve_topup(req_id: str, user: dict = Depends(get_current_user)):
+async def approve_topup(req_id: ObjectId = Depends(topup_oid), user: dict = Depends(get_current_user)):
     require_admin(user)
-    req = db["wallettopup"].find_one({"_id": ObjectId(req_id)})
+    claim = secrets.token_hex(8)
+    # Claim and read the request in one round-trip
+    req = await db["wallettopup"].find_one_and_update(
+        {"_id": req_id, "status": "pending"},
+        {"$set": {"status": "approving", "claim": claim, "updated_at": datetime.now(timezone.utc)}},
+        projection={"user_id": 1, "amount": 1},
+    )
+    if req:
+        await credit_topups([req], claim)
+        return {"status": "approved"}
+    # Nothing was claimed; only now look at why
+    req = await db["wallettopup"].find_one({"_id": req_id}, {"status": 1})
     if not req:
         raise HTTPException(status_code=404, detail="Topup request not found")
     if req.get("status") == "approved":
         return {"status": "already_approved"}
-    uid = req.get("user_id")
-    amount = int(req.get("amount", 0))
-    # credit balance
-    db["authuser"].update_one({"_id": ObjectId(uid)}, {"$inc": {"balance": amount}, "$set": {"updated_at": datetime.now(timezone.utc)}})
-    db["wallettopup"].update_one({"_id": ObjectId(req_id)}, {"$set": {"status": "approved", "updated_at": datetime.now(timezone.utc)}})
-    return {"status": "approved"}
+    raise HTTPException(status_code=409, detail="Topup request is not pending")
+
+
+@app.post("/admin/topup-requests/approve")
+async def approve_topups_bulk(req_ids: List[str] = Body(..., embed=True), user: dict = Depends(get_current_user)):
+    require_admin(user)
+    ids = [parse_object_id(r) for r in req_ids]
+    count = await approve_topups(ids)
+    return {"status": "approved", "count": count}
 
 
 @app.post("/admin/topup-requests/{req_id}/reject")
-def reject_topup(req_id: str, user: dict = Depends(get_current_user)):
+async def reject_topup(req_id: ObjectId = Depends(topup_oid), user: dict = Depends(get_current_user)):
     require_admin(user)
-    req = db["wallettopup"].find_one({"_id": ObjectId(req_id)})
+    req = await db["wallettopup"].find_one({"_id": req_id})
     if not req:
         raise HTTPException(status_code=404, detail="Topup request not found")
-    db["wallettopup"].update_one({"_id": ObjectId(req_id)}, {"$set": {"status": "rejected", "updated_at": datetime.now(timezone.utc)}})
+    await db["wallettopup"].update_one({"_id": req_id}, {"$set": {"status": "rejected", "updated_at": datetime.now(timezone.utc)}})
     return {"status": "rejected"}
 
 
 @app.get("/wallet")
-def wallet_balance(user: dict = Depends(get_current_user)):
-    fresh = get_user_by_email(user["email"]) or user
+async def wallet_balance(user: dict = Depends(get_current_user)):
+    # The cached identity carries no balance, so read just that field by _id
+    fresh = await db["authuser"].find_one({"_id": user["_id"]}, {"balance": 1}) or {}
     return {"balance": int(fresh.get("balance", 0))}
 
 
+# Parts of the /test report that are fixed for the life of the process
+if db is not None:
+    TEST_STATIC = {
+        "database_url": "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set",
+        "database_name": db.name if hasattr(db, 'name') else "✅ Connected",
+        "connection_status": "Connected",
+    }
+else:
+    TEST_STATIC = {"database_url": None, "database_name": None, "connection_status": "Not Connected"}
+
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
-        "database_url": None,
-        "database_name": None,
-        "connection_status": "Not Connected",
+        **TEST_STATIC,
         "collections": []
     }
     try:
         if db is not None:
             response["database"] = "✅ Available"
-            response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
-            response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -502,4 +765,12 @@ def test_database():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        log_level="warning",
+    )
@@ -0,0 +1,103 @@
+"""
+ASGI Middleware
+
+Small pure-ASGI middlewares used by the API. They wrap the app directly instead of
+going through Starlette's BaseHTTPMiddleware, so they add no per-request task or body copy.
+"""
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class MaxBodySizeMiddleware:
+    """Reject requests whose declared Content-Length exceeds `max_bytes` with 413 before reading the body"""
+
+    def __init__(self, app: ASGIApp, max_bytes: int) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > self.max_bytes:
+                        body = b'{"detail":"Request body too large"}'
+                        await send({
+                            "type": "http.response.start",
+                            "status": 413,
+                            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+                        })
+                        await send({"type": "http.response.body", "body": body})
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+
+class SkipPathGZipMiddleware:
+    """GZip responses except under `skip_prefix` (uploaded images are already compressed)"""
+
+    def __init__(self, app: ASGIApp, skip_prefix: str = "/uploads", **gzip_options) -> None:
+        self.app = app
+        self.skip_prefix = skip_prefix
+        self.gzip = GZipMiddleware(app, **gzip_options)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith(self.skip_prefix):
+            await self.app(scope, receive, send)
+        else:
+            await self.gzip(scope, receive, send)
+
+
+class AllowAllCORSMiddleware:
+    """CORS for any origin with credentials, emitting the same headers as Starlette's
+    CORSMiddleware(allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+    without its per-request origin matching and header objects.
+    """
+
+    ALLOW_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+    MAX_AGE = b"600"
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        origin = headers.get(b"origin")
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS" and b"access-control-request-method" in headers:
+            # Preflight is answered here without reaching the app
+            preflight_headers = [
+                (b"access-control-allow-origin", origin),
+                (b"vary", b"Origin"),
+                (b"access-control-allow-methods", self.ALLOW_METHODS),
+                (b"access-control-max-age", self.MAX_AGE),
+                (b"access-control-allow-credentials", b"true"),
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", b"2"),
+            ]
+            requested_headers = headers.get(b"access-control-request-headers")
+            if requested_headers:
+                preflight_headers.append((b"access-control-allow-headers", requested_headers))
+            await send({"type": "http.response.start", "status": 200, "headers": preflight_headers})
+            await send({"type": "http.response.body", "body": b"OK"})
+            return
+
+        # Browsers reject "*" on requests carrying cookies, so echo the origin for those
+        cors_headers = [(b"access-control-allow-credentials", b"true")]
+        if b"cookie" in headers:
+            cors_headers += [(b"access-control-allow-origin", origin), (b"vary", b"Origin")]
+        else:
+            cors_headers.append((b"access-control-allow-origin", b"*"))
+
+        async def send_with_cors(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + cors_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
@@ -38,8 +38,9 @@ class Product(BaseModel):
 
 class OrderItem(BaseModel):
     product_id: str
-    title: str
-    price: float
+    # Filled in from the catalogue by POST /orders; client values are ignored
+    title: Optional[str] = None
+    price: Optional[float] = None
     quantity: int = Field(..., ge=1)
     image: Optional[str] = None
 
@@ -49,10 +50,11 @@ class Order(BaseModel):
     buyer_email: str
     buyer_address: str
     items: List[OrderItem]
-    subtotal: float
+    # Computed by POST /orders from catalogue prices; client values are ignored
+    subtotal: Optional[float] = None
     discount: float = Field(0, ge=0)
-    delivery_fee: float
-    total: float
+    delivery_fee: float = Field(..., ge=0)
+    total: Optional[float] = None
     status: str = Field("pending")
     coupon_code: Optional[str] = None
     payment_method: Optional[str] = None
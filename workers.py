@@ -0,0 +1,12 @@
+"""
+Gunicorn Workers
+
+UvicornWorker with the event loop and HTTP parser pinned to uvloop and httptools, so a
+missing wheel fails at boot instead of silently falling back to asyncio and h11.
+"""
+
+from uvicorn.workers import UvicornWorker
+
+
+class UvloopWorker(UvicornWorker):
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}